@@ -2,28 +2,94 @@
 import uvicorn
 import asyncio
 import time
-import pandas as pd
+import sys
+import numpy as np
 import httpx
+import orjson
 import logging
-from fastapi import FastAPI, HTTPException
-from io import StringIO
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI, HTTPException, Response
+from io import BytesIO
+from functools import lru_cache
+
+try:
+    # Optional: PyArrow's multithreaded CSV reader is several times faster than pandas
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+    # pandas is only needed (and only paid for at import time) as the fallback parser
+    import pandas as pd
+
 # --- Configuration ---
 TELEMETRY_SOURCE_URL = "http://127.0.0.1:9001/counters"
 INGESTION_INTERVAL_SECONDS = 10 
 # Max time to wait for the generator to respond
 HTTP_TIMEOUT_SECONDS = 8 
+# Idle keep-alive for the ingestion connection; must exceed the polling interval so the
+# same TCP connection is reused every cycle instead of reconnecting each time
+HTTP_KEEPALIVE_SECONDS = 30
+# Read size for streaming the /counters body off the socket
+HTTP_CHUNK_SIZE = 64 * 1024
 
 # --- Logging Setup ---
 # This ensures logs go to both the file and the console for easier debugging and meets observability requirement.
+# Records are queued and written by a listener thread, so file/console I/O never blocks the event loop.
 log_file_path = 'aggregator_server.log'
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler(log_file_path),  # Handler for the file
+    logging.StreamHandler()              # Handler for the console (Terminal 2)
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_path),  # Handler for the file
-        logging.StreamHandler()              # Handler for the console (Terminal 2)
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+
+# --- Columnar Snapshot ---
+
+def _encode_arrow_stream(table) -> bytes:
+    """Serializes a pyarrow Table as an Arrow IPC stream."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _share_column(previous, column):
+    """Returns the previous snapshot's array when the new column is identical, so unchanged data is shared."""
+    if previous is not None and previous.dtype == column.dtype and np.array_equal(previous, column):
+        return previous
+    return column
+
+
+class Snapshot:
+    """
+    Immutable, columnar (structure-of-arrays) view of one ingestion cycle.
+    `index` maps switch_id -> row position; `columns` maps metric name -> NumPy array.
+    `arrow` holds the same data as an Arrow IPC stream when pyarrow is available.
+    """
+    __slots__ = ('index', 'columns', 'json', 'arrow')
+
+    def __init__(self, index: dict, columns: dict, arrow: bytes = None):
+        self.index = index
+        self.columns = columns
+        self.arrow = arrow
+        # The snapshot never changes after publication, so the ListMetrics body
+        # is encoded once per ingestion cycle instead of once per request
+        self.json = orjson.dumps(self.to_dict())
+
+    def to_dict(self) -> dict:
+        """Materialises the nested {switch_id: {metric: value}} view used by ListMetrics."""
+        names = list(self.columns)
+        # A switch_id column with no metric columns still yields one (empty) row per switch
+        rows = list(zip(*(column.tolist() for column in self.columns.values()))) or [()] * len(self.index)
+        return {sid: dict(zip(names, rows[row])) for sid, row in self.index.items()}
+
+EMPTY_SNAPSHOT = Snapshot({}, {})
 
 # --- Core RCU Data Store Implementation ---
 
@@ -34,51 +100,118 @@ class AggregatorServer:
     """
     def __init__(self):
         # The public data store (The 'Read' copy)
-        self.current_data = {} 
-        # Lock protects only the instantaneous pointer swap, not the data access
-        self.swap_lock = asyncio.Lock() 
+        self.current_data = EMPTY_SNAPSHOT 
+        # Bumped on every publish; keys the GetMetric response cache to one snapshot
+        self.version = 0
+        self._encoded_data = lru_cache(maxsize=4096)(self._encode_data)
 
-    def get_data(self, switch_id: str = None, metric_name: str = None):
+    def _read_snapshot(self) -> Snapshot:
+        """Returns the currently published snapshot, or 503 before the first ingestion."""
+        snapshot = self.current_data
+        
+        if not snapshot.index:
+            raise HTTPException(status_code=503, detail="Data unavailable. Store is empty; waiting for initial ingestion.")
+        
+        return snapshot
+
+    def get_encoded_metrics(self) -> bytes:
         """
-        Public method for non-blocking data access (The Read).
+        Non-blocking ListMetrics read: the full snapshot as JSON, pre-encoded by the writer.
+        """
+        return self._read_snapshot().json
+
+    def get_arrow_metrics(self) -> bytes:
+        """
+        Non-blocking ListMetrics read in Arrow IPC stream format, pre-encoded by the writer.
         """
-        data = self.current_data
+        snapshot = self._read_snapshot()
         
-        if not data:
-            raise HTTPException(status_code=503, detail="Data unavailable. Store is empty; waiting for initial ingestion.")
+        if snapshot.arrow is None:
+            raise HTTPException(status_code=501, detail="Arrow output requires pyarrow to be installed on the server.")
         
-        if switch_id is None:
-            # ListMetrics request
-            return data
+        return snapshot.arrow
+
+    def get_data(self, switch_id: str, metric_name: str = None):
+        """
+        Public method for non-blocking data access (The Read).
+        """
+        snapshot = self._read_snapshot()
         
         # GetMetric request
-        if switch_id not in data:
+        if switch_id not in snapshot.index:
             raise HTTPException(status_code=404, detail=f"Switch ID '{switch_id}' not found.")
         
+        row = snapshot.index[switch_id]
         if metric_name is None:
-            return data[switch_id]
+            # item() converts the NumPy scalar to a native Python value for serialization
+            return {name: column.item(row) for name, column in snapshot.columns.items()}
 
-        if metric_name not in data[switch_id]:
-            valid_metrics = list(data[switch_id].keys())
-            raise HTTPException(status_code=404, detail=f"Metric '{metric_name}' not found for switch '{switch_id}'. Valid metrics are: {', '.join(valid_metrics)}")
+        if metric_name not in snapshot.columns:
+            raise HTTPException(status_code=404, detail=f"Metric '{metric_name}' not found for switch '{switch_id}'. Valid metrics are: {', '.join(snapshot.columns)}")
         
-        return {metric_name: data[switch_id][metric_name]}
+        return {metric_name: snapshot.columns[metric_name].item(row)}
+
+    def _encode_data(self, version: int, switch_id: str, metric_name: str = None) -> bytes:
+        """Encodes a GetMetric result; `version` only keys the cache to the current snapshot."""
+        return orjson.dumps(self.get_data(switch_id, metric_name))
 
-    def _parse_csv_to_dict(self, csv_content: str) -> dict:
-        """Parses the CSV content into the required nested dictionary format."""
+    def get_encoded_data(self, switch_id: str, metric_name: str = None) -> bytes:
+        """
+        GetMetric read returning encoded JSON. Snapshots are immutable, so the result
+        is cached per (version, switch_id, metric_name) until the next swap.
+        """
+        return self._encoded_data(self.version, switch_id, metric_name)
+
+    def _parse_csv_to_snapshot(self, csv_content: bytearray, previous: Snapshot) -> Snapshot:
+        """
+        Parses the raw CSV bytes into a columnar Snapshot.
+        Unchanged parts of the previous snapshot are shared rather than rebuilt.
+        """
+        
+        table = None
+        if pa is None:
+            # Fallback: use pandas for robust, efficient CSV parsing
+            df = pd.read_csv(BytesIO(csv_content))
+            ids = df.pop('switch_id').tolist()
+            columns = {name: df[name].to_numpy() for name in df.columns}
+        else:
+            table = pacsv.read_csv(
+                pa.py_buffer(csv_content),
+                read_options=pacsv.ReadOptions(use_threads=True, block_size=1 << 20),
+                convert_options=pacsv.ConvertOptions(strings_can_be_null=False),
+            )
+            ids = table.column('switch_id').to_pylist()
+            columns = {name: table.column(name).to_numpy() for name in table.column_names if name != 'switch_id'}
+        
+        # Intern the names so every snapshot shares one str object per metric/switch; this
+        # trims memory and lets comparisons below hit CPython's pointer-equality fast path
+        ids = [sys.intern(str(sid)) for sid in ids]
+        columns = {sys.intern(name): column for name, column in columns.items()}
         
-        # Use pandas for robust, efficient CSV parsing
-        df = pd.read_csv(StringIO(csv_content))
-        df = df.set_index('switch_id')
+        index = {sid: row for row, sid in enumerate(ids)}
+        if len(index) != len(ids):
+            # Reject the whole payload (the old data is retained) rather than letting the last row win
+            raise ValueError("switch_id values must be unique")
         
-        # Convert DataFrame to the required nested dictionary structure
-        return df.to_dict('index')
+        # Structural sharing: with the same switch set, reuse the previous index and any
+        # column whose values did not change, so allocation tracks churn rather than store size
+        if ids == list(previous.index):
+            index = previous.index
+            columns = {name: _share_column(previous.columns.get(name), column) for name, column in columns.items()}
+            if list(columns) == list(previous.columns) and all(column is previous.columns[name] for name, column in columns.items()):
+                # Nothing changed: keep the snapshot and its already-encoded payloads
+                return previous
+        
+        arrow = _encode_arrow_stream(table) if table is not None else None
+        return Snapshot(index, columns, arrow)
 
-    async def _swap_data(self, new_snapshot: dict):
+    def _swap_data(self, new_snapshot: Snapshot):
         """Performs the atomic RCU pointer swap."""
-        async with self.swap_lock:
-            # The instantaneous swap is the only part requiring a lock
+        # A single attribute assignment is atomic in CPython and there is only one
+        # writer task, so publishing the new snapshot needs no lock
+        if new_snapshot is not self.current_data:
             self.current_data = new_snapshot 
+            self.version += 1
 
     async def ingestion_task(self):
         """
@@ -86,31 +219,40 @@ class AggregatorServer:
         This loop is designed to be resilient and non-crashing.
         """
         # Client initialized here so it lives for the lifetime of the task
-        client = httpx.AsyncClient() 
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_keepalive_connections=1, keepalive_expiry=HTTP_KEEPALIVE_SECONDS),
+        ) 
         
         logging.info("Background ingestion task started.")
 
         while True:
-            start_time = time.time()
+            # Monotonic integer nanoseconds: no float math and unaffected by wall-clock jumps
+            start_ns = time.perf_counter_ns()
             
             try:
-                # 1. Fetch data from the generator
-                response = await client.get(TELEMETRY_SOURCE_URL, timeout=HTTP_TIMEOUT_SECONDS)
-                # raise_for_status() is key for error handling (raises exception for 4xx/5xx)
-                response.raise_for_status() 
+                # 1. Fetch data from the generator, streaming the body into a single growable buffer
+                async with client.stream("GET", TELEMETRY_SOURCE_URL) as response:
+                    # raise_for_status() is key for error handling (raises exception for 4xx/5xx)
+                    response.raise_for_status() 
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes(HTTP_CHUNK_SIZE):
+                        body += chunk
 
                 # 2. Parse data and perform RCU update
-                # Parsing is done *outside* the lock
-                new_data = self._parse_csv_to_dict(response.text)
+                # Parsing is done before the swap, in a worker thread so the
+                # event loop keeps serving API readers while the CSV is parsed.
+                # The raw body is parsed directly, skipping a full str decode of the payload
+                new_data = await asyncio.to_thread(self._parse_csv_to_snapshot, body, self.current_data)
                 
-                # Atomic RCU swap (protected by lock, but very fast)
-                await self._swap_data(new_data)
+                # Atomic RCU swap (a single reference assignment)
+                self._swap_data(new_data)
                 
-                end_time = time.time()
                 # Log performance stat
-                logging.info(f"RCU Swap: Successfully updated store. Time taken: {(end_time - start_time) * 1000:.0f}ms")
+                elapsed_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+                logging.info(f"RCU Swap: Successfully updated store. Time taken: {elapsed_ms}ms")
 
-            except httpx.RequestError as e:
+            except (httpx.RequestError, httpx.HTTPStatusError) as e:
                 # Catches network errors (connection refused, DNS) and HTTP status errors (500, 404)
                 logging.error(f"Ingestion failed (HTTP Request/Network Error): {e}. Retaining old data.")
             except Exception as e:
@@ -135,39 +277,46 @@ async def startup_event():
     # This prevents the "missing 'self'" error
     asyncio.create_task(telemetry_store.ingestion_task()) 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flushes queued log records before the process exits."""
+    log_listener.stop()
+
 
 # --- API Endpoints (Readers) ---
 
 # In aggregator_server.py
 
 @app.get("/telemetry/ListMetrics", 
-         summary="Fetch all current metrics for all switches.",
-         response_model=dict)
+         summary="Fetch all current metrics for all switches.")
 async def list_metrics():
     """Retrieves the full telemetry snapshot from the RCU store."""
     
-    start_time = time.time()  # Start timer
+    start_ns = time.perf_counter_ns()  # Start timer
     
-    # 1. Get data (fast, non-blocking RCU read)
-    response_data = telemetry_store.get_data()
-    
-    end_time = time.time()
-    latency_ms = (end_time - start_time) * 1000
+    # 1. Get data (fast, non-blocking RCU read of the pre-encoded body)
+    response_body = telemetry_store.get_encoded_metrics()
     
     # 2. Log API latency (New Requirement)
-    logging.info(f"API Latency: ListMetrics completed in {latency_ms:.2f}ms.")
+    # Per-request logs are DEBUG-only and gated so the hot path skips formatting entirely
+    if logging.root.isEnabledFor(logging.DEBUG):
+        latency_us = (time.perf_counter_ns() - start_ns) // 1000
+        logging.debug(f"API Latency: ListMetrics completed in {latency_us}us.")
     
-    return response_data
+    return Response(content=response_body, media_type="application/json")
 
 @app.get("/telemetry/GetMetric", 
-         summary="Fetch a specific metric value for a given switch ID.",
-         response_model=dict)
+         summary="Fetch a specific metric value for a given switch ID.")
 async def get_metric(switch_id: str, metric_name: str = None):
     """Retrieves a specific metric or all metrics for one switch."""
-    if metric_name:
-        return telemetry_store.get_data(switch_id=switch_id, metric_name=metric_name)
-    else:
-        return telemetry_store.get_data(switch_id=switch_id)
+    response_body = telemetry_store.get_encoded_data(switch_id=switch_id, metric_name=metric_name or None)
+    return Response(content=response_body, media_type="application/json")
+
+@app.get("/telemetry/arrow/ListMetrics", 
+         summary="Fetch all current metrics for all switches as an Arrow IPC stream.")
+async def list_metrics_arrow():
+    """Retrieves the full telemetry snapshot in Arrow columnar format (binary, no JSON encoding)."""
+    return Response(content=telemetry_store.get_arrow_metrics(), media_type="application/vnd.apache.arrow.stream")
 
 
 if __name__ == "__main__":
@@ -1,79 +1,147 @@
 # generator.py
 import uvicorn
+import asyncio
 import random
-import csv
-from io import StringIO
-from fastapi import FastAPI, Response, HTTPException
-from fastapi.responses import PlainTextResponse
+import operator
+import numpy as np
+import orjson
+from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse
 import time
 import sys
+import os
 
 # --- Configuration ---
 NUM_SWITCHES = 50
 SWITCH_PREFIX = "SW-"
+# Switch IDs never change, so they are formatted once instead of on every snapshot
+SWITCH_IDS = tuple(f"{SWITCH_PREFIX}{i:02d}" for i in range(NUM_SWITCHES))
+# Keep idle client connections open longer than the aggregator's 10s polling interval
+KEEP_ALIVE_SECONDS = 30
+# Concurrent /counters callers within this window share one generated payload
+CACHE_TTL_SECONDS = 0.25
+# Push cadence for /counters/stream
+STREAM_INTERVAL_SECONDS = 1
+# Per-snapshot console output is off by default; a synchronous print on every /counters hit is costly
+LOG_VERBOSE = os.environ.get('TELEMETRY_VERBOSE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+# The CSV schema is fixed, so the column order and header line are built once at import
+METRIC_FIELDS = ('Bandwidth_Rx_Gbps', 'Latency_Avg_uSec', 'Error_CRC_Count', 'Port_Status')
+FIELDNAMES = ('switch_id',) + METRIC_FIELDS
+_HEADER_LINE_BYTES = (','.join(FIELDNAMES) + '\r\n').encode('ascii')
+# Rows are derived from the same schema, so header and values can never fall out of step
+_ROW_FMT = ','.join('{}' for _ in FIELDNAMES) + '\r\n'
+_metric_values = operator.itemgetter(*METRIC_FIELDS)
 
 # --- State Variables for Simulation ---
 telemetry_data = {} 
 SIMULATION_MODE = "NORMAL" # Can be set via query parameter
+_rng = np.random.default_rng()
+
+# --- Payload Cache ---
+# CSV and JSON bodies of the same snapshot, refreshed together
+_cached_csv = None
+_cached_json = None
+_cached_ts = 0.0
+_cache_lock = asyncio.Lock()
 
 # --- Data Generation Functions ---
 
-def generate_telemetry_snapshot():
-    """Generates a new, random set of metrics for all switches."""
-    global telemetry_data
+def generate_telemetry_snapshot() -> dict:
+    """
+    Generates and returns a new, random set of metrics for all switches.
+    Builds a fresh dict and publishes nothing, so callers decide when it becomes visible.
+    """
+    # Draw every metric for all switches in one vectorized call each, instead of
+    # several Python-level random calls per switch
+    n = NUM_SWITCHES
     
-    new_snapshot = {}
-    for i in range(NUM_SWITCHES):
-        switch_id = f"{SWITCH_PREFIX}{i:02d}"
-        
-        # Simulate realistic random data
-        bandwidth = round(random.uniform(0.0, 100.0), 1)
-        latency = round(random.uniform(1.0, 500.0), 1)
-        # Introduce a spike risk for Latency/Errors 5% of the time
-        if random.random() < 0.05:
-            errors = random.randint(500, 1000) # High error spike
-            latency = round(random.uniform(1000.0, 5000.0), 1) # High latency spike
-        else:
-            errors = random.randint(0, 10)
-        
-        port_status = "DOWN" if random.random() < 0.02 else "UP" # 2% chance of a port down
-        
-        new_snapshot[switch_id] = {
-            "Bandwidth_Rx_Gbps": bandwidth,
-            "Latency_Avg_uSec": latency,
-            "Error_CRC_Count": errors,
-            "Port_Status": port_status
-        }
+    # Simulate realistic random data. One-decimal values are drawn as integer tenths and
+    # scaled once, instead of a float uniform() followed by round()
+    bandwidth = _rng.integers(0, 1001, n) / 10
+    # Introduce a spike risk for Latency/Errors 5% of the time
+    spike = _rng.random(n) < 0.05
+    latency = np.where(spike, _rng.integers(10000, 50001, n), _rng.integers(10, 5001, n)) / 10 # High latency spike
+    errors = np.where(spike, _rng.integers(500, 1001, n), _rng.integers(0, 11, n)) # High error spike
+    port_down = _rng.random(n) < 0.02 # 2% chance of a port down
     
-    telemetry_data = new_snapshot
-    print(f"[{time.strftime('%H:%M:%S')}] Generator: New snapshot generated for {NUM_SWITCHES} switches.")
-
-def get_csv_matrix(corrupt=False):
-    """Converts the current dictionary data into the required CSV matrix format."""
+    # Columns in METRIC_FIELDS order
+    columns = (bandwidth.tolist(), latency.tolist(), errors.tolist(), ["DOWN" if down else "UP" for down in port_down.tolist()])
+    new_snapshot = {
+        switch_id: dict(zip(METRIC_FIELDS, values))
+        for switch_id, values in zip(SWITCH_IDS, zip(*columns))
+    }
     
-    if not telemetry_data:
-        return ""
+    if LOG_VERBOSE:
+        print(f"[{time.strftime('%H:%M:%S')}] Generator: New snapshot generated for {NUM_SWITCHES} switches.")
+    return new_snapshot
 
-    metrics = list(telemetry_data[f"{SWITCH_PREFIX}00"].keys())
-    fieldnames = ['switch_id'] + metrics
+def _corrupt_cut() -> int:
+    """Number of bytes CORRUPT mode cuts off the end of a payload (a longer cut leaves it empty)."""
+    return random.randint(50, 100)
 
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    
-    writer.writeheader()
+def get_csv_matrix(snapshot: dict, corrupt=False) -> bytes:
+    """Converts a snapshot into the required CSV matrix format, as ASCII bytes."""
     
-    for switch_id, metrics in telemetry_data.items():
-        row = {'switch_id': switch_id}
-        row.update(metrics)
-        writer.writerow(row)
+    if not snapshot:
+        return b""
+
+    # Values are numbers, SW-NN ids and UP/DOWN, so no CSV quoting is ever needed:
+    # each row is a single format call, appended as ASCII bytes straight into one growing buffer
+    buf = bytearray(_HEADER_LINE_BYTES)
+    for sid, m in snapshot.items():
+        buf += _ROW_FMT.format(sid, *_metric_values(m)).encode('ascii')
         
-    content = output.getvalue()
-    
     if corrupt:
-        # Simulate CSV corruption by cutting off the end
-        return content[:-random.randint(50, 100)] 
+        # Simulate CSV corruption by cutting off the end, in place, before the single copy out
+        del buf[-_corrupt_cut():]
     
-    return content
+    return bytes(buf)
+
+
+def build_payload(corrupt=False):
+    """
+    Generates a fresh snapshot and serializes it (CPU-bound; run off the event loop).
+    Returns the snapshot together with its CSV payload.
+    """
+    global telemetry_data
+    
+    snapshot = generate_telemetry_snapshot()
+    payload = get_csv_matrix(snapshot, corrupt=corrupt)
+    # Publish only the finished snapshot, with a single (atomic) reference swap
+    telemetry_data = snapshot
+    return snapshot, payload
+
+def build_cache_entry():
+    """Builds the CSV and JSON bodies of one fresh snapshot (CPU-bound; run off the event loop)."""
+    snapshot, csv_payload = build_payload()
+    return csv_payload, orjson.dumps(snapshot)
+
+async def refresh_cache():
+    """Regenerates the cached snapshot bodies at most once per CACHE_TTL_SECONDS."""
+    global _cached_csv, _cached_json, _cached_ts
+    
+    if time.monotonic() - _cached_ts > CACHE_TTL_SECONDS:
+        async with _cache_lock:
+            # Re-check: another request may have refreshed the cache while we waited
+            now = time.monotonic()
+            if now - _cached_ts > CACHE_TTL_SECONDS:
+                _cached_csv, _cached_json = await asyncio.to_thread(build_cache_entry)
+                _cached_ts = now
+
+async def get_cached_csv_matrix():
+    """Returns the CSV matrix of the cached snapshot."""
+    await refresh_cache()
+    return _cached_csv
+
+async def get_cached_json():
+    """Returns the JSON body of the same cached snapshot as get_cached_csv_matrix()."""
+    await refresh_cache()
+    return _cached_json
+
+
+def _effective_mode(mode: str) -> str:
+    """Uses the query parameter if provided, otherwise the sticky command-line mode."""
+    return mode.upper() if mode.upper() != "NORMAL" else SIMULATION_MODE
 
 
 # --- FastAPI App ---
@@ -82,20 +150,20 @@ app = FastAPI(title="Telemetry Data Server (Producer)")
 @app.on_event("startup")
 async def startup_event():
     # Initial data generation on startup
-    generate_telemetry_snapshot()
+    global telemetry_data
+    telemetry_data = generate_telemetry_snapshot()
     print("Telemetry Generator started on 127.0.0.1:9001. Use /counters?mode=ERROR to simulate failure.")
 
 
 @app.get("/counters", summary="Returns all telemetry data in CSV matrix format")
-async def get_counters(mode: str = "NORMAL"):
+async def get_counters(request: Request, mode: str = "NORMAL"):
     """
     Implements the required GET http://127.0.0.1:9001/counters endpoint with simulation modes.
     Checks the URL query parameter first, then falls back to the sticky command-line mode.
+    Clients sending 'Accept: application/json' get the snapshot as JSON instead of CSV.
     """
-    global SIMULATION_MODE
-    
     # Determine the effective mode: Use the query parameter if provided, otherwise use the global sticky mode
-    effective_mode = mode.upper() if mode.upper() != "NORMAL" else SIMULATION_MODE
+    effective_mode = _effective_mode(mode)
 
     if effective_mode == "ERROR_500":
         print(f"[{time.strftime('%H:%M:%S')}] Generator: Simulating HTTP 500 Internal Error.")
@@ -104,17 +172,61 @@ async def get_counters(mode: str = "NORMAL"):
     
     if effective_mode == "SLOW":
         print(f"[{time.strftime('%H:%M:%S')}] Generator: Simulating 5s network congestion delay.")
-        time.sleep(5)
+        # Yield to the event loop so only this request is delayed, not the whole server
+        await asyncio.sleep(5)
+    
+    if "application/json" in request.headers.get("accept", ""):
+        # Served from the shared cache, so JSON consumers skip the CSV encode/parse round-trip
+        # and see the same snapshot as CSV callers. CORRUPT only applies to CSV
+        return Response(content=await get_cached_json(), media_type="application/json")
     
     corrupt = (effective_mode == "CORRUPT")
     
-    # Re-generate data for fresh metrics on every call (simulating constant updates)
-    generate_telemetry_snapshot()
+    if corrupt and _cached_csv:
+        # The tail is thrown away anyway, so truncate the last cached payload instead of
+        # generating and serializing a fresh snapshot. Corrupted payloads are never cached
+        csv_content = _cached_csv[:-_corrupt_cut()]
+    elif corrupt:
+        # Cold start: nothing cached yet
+        _, csv_content = await asyncio.to_thread(build_payload, corrupt=True)
+    else:
+        # Fresh metrics (simulating constant updates), shared by callers within the cache TTL
+        csv_content = await get_cached_csv_matrix()
+    
+    # Return the pre-encoded bytes with the correct Content-Type; a plain Response uses
+    # bytes content as the body directly (Starlette still appends the charset for text/*)
+    return Response(content=csv_content, media_type="text/csv")
+
+
+@app.get("/counters/stream", summary=f"Streams a fresh CSV matrix every {STREAM_INTERVAL_SECONDS}s over one connection")
+async def stream_counters(mode: str = "NORMAL"):
+    """
+    Pushes successive snapshots over one persistent connection, so monitoring clients pay
+    connection/header overhead once per session instead of once per poll.
+    Each CSV matrix is followed by a '---' separator line. Simulation modes apply as on
+    /counters: ERROR_500 fails the request, SLOW delays and CORRUPT truncates every push.
+    """
+    effective_mode = _effective_mode(mode)
+    
+    if effective_mode == "ERROR_500":
+        print(f"[{time.strftime('%H:%M:%S')}] Generator: Simulating HTTP 500 Internal Error.")
+        raise HTTPException(status_code=500, detail="Simulated Internal Server Error")
+    
+    if effective_mode == "SLOW":
+        print(f"[{time.strftime('%H:%M:%S')}] Generator: Simulating 5s network congestion delay per push.")
     
-    csv_content = get_csv_matrix(corrupt=corrupt)
+    async def snapshot_stream():
+        while True:
+            if effective_mode == "SLOW":
+                await asyncio.sleep(5)
+            csv_content = await get_cached_csv_matrix()
+            if effective_mode == "CORRUPT":
+                # Truncated mid-row, but the separator still goes on a line of its own
+                csv_content = csv_content[:-_corrupt_cut()] + b"\r\n"
+            yield csv_content + b"---\r\n"
+            await asyncio.sleep(STREAM_INTERVAL_SECONDS)
     
-    # Return as a plain text response with the correct Content-Type
-    return PlainTextResponse(content=csv_content, media_type="text/csv")
+    return StreamingResponse(snapshot_stream(), media_type="text/csv")
 
 
 if __name__ == "__main__":
@@ -123,6 +235,6 @@ if __name__ == "__main__":
         SIMULATION_MODE = sys.argv[1].upper()
         print(f"Generator running in permanent mode: {SIMULATION_MODE}")
     
-    uvicorn.run(app, host="127.0.0.1", port=9001)
+    uvicorn.run(app, host="127.0.0.1", port=9001, timeout_keep_alive=KEEP_ALIVE_SECONDS)
 
 # --- End of generator.py ---